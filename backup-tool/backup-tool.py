@@ -1,95 +1,68 @@
 #!/usr/bin/env python3
 import argparse
-import json
+import asyncio
 import logging
-import subprocess
+import os
 import sys
 import time
 
-from typing import Dict, Any
-
-# pip install cs
-import cs
-
-# pip install storpool
-from storpool import spapi
-import confget
+from typing import Dict, Any, List, Optional, Set
+
+# the shared core package is in the parent directory of this script
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+)
+
+from cloudstack_dr import (
+    ApiError,
+    CloudStackApi,
+    CloudStackError,
+    StorPoolApi,
+    fix_map,
+    get_backup_list,
+    get_vm_backups,
+    read_cloudstack_config,
+    read_config,
+    read_storpool_config,
+)
+from cloudstack_dr.timings import (
+    DEFAULT_TIMINGS,
+    get_latency,
+    get_missing,
+    get_transfer_rate,
+    load_timings,
+    record_timing,
+    save_timings,
+    timed,
+)
 
 config = None  # Config is in /etc/storpool/backup-tool.conf
-cs_api = None
-sp_api = None
-
-
-def get_apis():
-    global cs_api, sp_api
-    if cs_api is None:
-        cs_api = cs.CloudStack(**cs.read_config())
-    if sp_api is None:
-        sp_api = spapi.Api.fromConfig()
-
-
-def read_config():
-    global config
-    config = confget.read_ini_file(confget.Config(
-        [], filename="/etc/storpool/backup-tool.conf"
-    ))[""]
-
-
-def get_backup_list(vm: str) -> Dict[int, Dict[str, Any]]:
-    cmd = [
-        'storpool_vcctl',
-        'status',
-        '--json',
-    ]
-
-    if "VC_SSH_HOST" in config:
-        cmd = [
-            "ssh",
-            "-l", config.get("VC_SSH_USER", "root"),
-            config["VC_SSH_HOST"],
-        ] + cmd
-
-    process = subprocess.run(
-        cmd, stdout=subprocess.PIPE, check=True, encoding="utf_8"
-    )
-    res = json.loads(process.stdout)
-
-    backup_name = f"cvm={vm}"
-    for bck in res:
-        if (
-            bck["type"] == "vm" and
-            bck["id"]["name"] == backup_name
-        ):
-            logging.debug("backups found for VM %s", vm)
-            history = bck["history"]
-            return {
-                entry["create_ts"]: entry
-                for entry in history
-                if entry["id"]["location"] == config["SP_BACKUP_CLUSTER_ID"]
-            }
-
-    # no backups found
-    return {}
-
-
-def wait_job(jobid, timeout=10):
-    for _ in range(timeout):
-        time.sleep(1)
-        job = cs_api.queryAsyncJobResult(jobid=jobid)
-        if job["jobstatus"] != 0:  # 0 = running
-            return job["jobresult"]
-    raise RuntimeError("Timeout")
-
-
-def fix_map(map:Dict[Any, Any]) -> None:
-    """
-    Removes leading ~ in the key names
-    """
-    for key in list(map.keys()):
-        if key[0] == "~":
-            trimmed_k = key[1:]
-            map[trimmed_k] = map.pop(key)
 
+# timings of earlier runs, used by --plan for the estimation
+TIMINGS_FILE = "~/.backup-tool-timings.json"
+
+# StorPool volume tags written by CloudStack and by the DR tools
+GC_VOLUME_TAGS = ("cs", "cvm", "uuid")
+# name of the CloudStack volumes created by create_volume_and_attach()
+RESTORE_VOLUME_PREFIX = "Restore of "
+# CloudStack volume paths of StorPool volumes, by global ID or by name
+CS_PATH_PREFIXES = ("/dev/storpool-byid/", "/dev/storpool/")
+# seconds between the checks of a snapshot transfer from the backup cluster
+TRANSFER_POLL_INTERVAL = 2
+# seconds from the start of a transfer to wait for it after the restore,
+# to record its duration. Longer transfers are not recorded.
+TRANSFER_RECORD_TIMEOUT = 120
+# StorPool snapshot tags written by VolumeCare
+VC_SNAPSHOT_TAGS = ("vc-policy", "vc_policy")
+
+
+async def get_backups(vm: str) -> Dict[int, Dict[str, Any]]:
+    with timed("vcctl_status"):
+        res = await get_backup_list(config)
+    return {
+        entry["create_ts"]: entry
+        for entry in get_vm_backups(res, vm, config["SP_BACKUP_CLUSTER_ID"])
+    }
 
 
 def list_volumes(backup_list, quiet=False):
@@ -106,14 +79,84 @@ def list_volumes(backup_list, quiet=False):
             )
 
 
+async def copy_from_remote(sp_api: StorPoolApi, snapshot_name: str) -> None:
+    """
+    Copies the snapshot from the backup cluster to the local cluster
+    """
+    args = {
+        "remoteId": snapshot_name.lstrip("~"),
+        "remoteLocation": config["SP_BACKUP_LOCATION_NAME"],
+        "template": config["SP_LOCAL_TEMPLATE"],
+    }
+    try:
+        with timed("snapshot_from_remote"):
+            await sp_api.snapshotFromRemote(args)
+    except ApiError as err:
+        # A local copy of the snapshot may already be created. This is OK.
+        if err.name != "objectExists":
+            raise
+
+
+async def wait_for_transfer(sp_api: StorPoolApi, snapshot_names: List[str],
+                            start: float, timeout: float) -> None:
+    """
+    Waits until the local copies of the snapshots are fully transferred
+    from the backup cluster, and records the transfer time and size.
+    The snapshots are matched by global ID, e.g. ~bgu4.b.dkt
+
+    The restore doesn't need the data to be transferred. This is called
+    after it, only to record the transfer rate for the planner, and gives up
+    `timeout` seconds after `start` of the transfer.
+    """
+    gids = {name.lstrip("~") for name in snapshot_names}
+    while True:
+        snapshots = [
+            snap
+            for snap in await sp_api.snapshotsList()
+            if snap["globalId"] in gids
+        ]
+        missing = gids - {snap["globalId"] for snap in snapshots}
+        if missing:
+            raise RuntimeError(
+                f"Snapshots {', '.join(sorted(missing))} not found "
+                "on the local cluster"
+            )
+        if not any(snap.get("recoveringFromRemote") for snap in snapshots):
+            break
+        if time.monotonic() - start > timeout:
+            logging.info("The transfer is not completed in %ds. "
+                         "Its duration is not recorded", timeout)
+            return
+        await asyncio.sleep(TRANSFER_POLL_INTERVAL)
+    size = sum(snap["size"] for snap in snapshots)
+    record_timing("transfer", time.monotonic() - start, size)
+
+
+def get_transfer_record_timeout() -> float:
+    return float(config.get("TRANSFER_RECORD_TIMEOUT",
+                            TRANSFER_RECORD_TIMEOUT))
+
+
+async def revert_volume(sp_api: StorPoolApi, volume_name: str,
+                        snapshot_name: str) -> None:
+    logging.debug("Revert volume %s to snapshot %s",
+        volume_name, snapshot_name)
+    with timed("volume_revert"):
+        await sp_api.volumeRevert(volume_name, {
+            "toSnapshot": snapshot_name,
+        })
 
-def is_error_cs_result(res):
-    if "errorcode" in res:
-        logging.error("Error executing CS command: %s", res["errortext"])
-        sys.exit(1)
 
+async def delete_snapshot(sp_api: StorPoolApi, snapshot_name: str) -> None:
+    with timed("snapshot_delete"):
+        await sp_api.snapshotDelete(snapshot_name)
 
-def revert_vm(backup: Dict[str, Any]) -> None:
+
+async def revert_vm(
+        cs_api: CloudStackApi,
+        sp_api: StorPoolApi,
+        backup: Dict[str, Any]
+) -> None:
     """
     Restores a VM from a backup
 
@@ -129,8 +172,9 @@ def revert_vm(backup: Dict[str, Any]) -> None:
 
     logging.debug("Getting volume list for VM UUID %s", vm_uuid)
     # get volumes uuid and sp GID
-    res = cs_api.listVolumes(virtualmachineid=vm_uuid, listall=True)
-    is_error_cs_result(res)
+    with timed("cs_list"):
+        res = await cs_api.call("listVolumes", virtualmachineid=vm_uuid,
+                                listall=True)
 
     # make sure all volumes are in the backup
     volume_list = res["volume"]
@@ -150,9 +194,10 @@ def revert_vm(backup: Dict[str, Any]) -> None:
 
     # Stop the VM
     logging.info("Stopping VM %s", vm_uuid)
-    jobid = cs_api.stopVirtualMachine(id=vm_uuid, forced=True)["jobid"]
-    res = wait_job(jobid, timeout=30)
-    is_error_cs_result(res)
+    with timed("stop_vm"):
+        job = await cs_api.call_async("stopVirtualMachine", id=vm_uuid,
+                                      forced=True, timeout=30)
+        res = await job
     vm = res["virtualmachine"]
     assert vm["state"] == "Stopped"
     logging.debug("VM %s is stopped", vm_uuid)
@@ -171,47 +216,41 @@ def revert_vm(backup: Dict[str, Any]) -> None:
             for vol in volume_list
         ],
     }
-    sp_api.volumesReassignWait(args)
+    with timed("reassign"):
+        await sp_api.volumesReassignWait(args)
 
     # copy snapshots to the local cluster
     logging.debug("Copy snapshots to the local cluster")
-    for vol in volume_list:
-        snapshot_name = vol["sp_snapshot"]
-        snapshot_gid = snapshot_name.lstrip("~")
-        args = {
-            "remoteId": snapshot_gid,
-            "remoteLocation": config["SP_BACKUP_LOCATION_NAME"],
-            "template": config["SP_LOCAL_TEMPLATE"],
-        }
-        try:
-            res = sp_api.snapshotFromRemote(args)
-        except spapi.ApiError as err:
-            # A local copy of the snapshot may already be created. This is OK.
-            if err.name != "objectExists":
-                raise
+    transfer_start = time.monotonic()
+    await asyncio.gather(*(
+        copy_from_remote(sp_api, vol["sp_snapshot"])
+        for vol in volume_list
+    ))
 
     # revert volumes using local snapshots
     logging.debug("Revert volumes using local snapshots")
-    for vol in volume_list:
-        volume_name = vol["sp_volume_name"]
-        snapshot_name = vol["sp_snapshot"]
-        args = {
-            "toSnapshot": snapshot_name,
-        }
-        logging.debug("Revert volume %s to snapshot %s",
-            volume_name, snapshot_name)
-        res = sp_api.volumeRevert(volume_name, args)
+    await asyncio.gather(*(
+        revert_volume(sp_api, vol["sp_volume_name"], vol["sp_snapshot"])
+        for vol in volume_list
+    ))
+
+    logging.info("Revert completed")
+
+    # the volumes are reverted, the data is transferred in the background
+    await wait_for_transfer(sp_api, [vol["sp_snapshot"] for vol in volume_list],
+                            transfer_start, get_transfer_record_timeout())
 
     # delete snapshots on the local cluster
     logging.debug("Delete snapshots on the local cluster")
-    for vol in volume_list:
-        snapshot_name = vol["sp_snapshot"]
-        sp_api.snapshotDelete(snapshot_name)
-
-    logging.info("Revert completed")
+    await asyncio.gather(*(
+        delete_snapshot(sp_api, vol["sp_snapshot"])
+        for vol in volume_list
+    ))
 
 
-def create_volume_and_attach(
+async def create_volume_and_attach(
+        cs_api: CloudStackApi,
+        sp_api: StorPoolApi,
         volume_uuid: str,
         backup: Dict[str, Any],
         server: str
@@ -222,7 +261,7 @@ def create_volume_and_attach(
     volume, and attach the volume to an existing VM (server).
 
     :param volume_uuid: UUID of the volume to be restored
-    :param backup: backup item, as returned by get_backup_list()
+    :param backup: backup item, as returned by get_backups()
     :param server: UUID of the VM that the restored volume will be attached to
     :return: None
     """
@@ -234,31 +273,26 @@ def create_volume_and_attach(
     snapshot_gid = snapshot_name.lstrip("~")
 
     #
-    # copy the snapshot to the local cluster
+    # copy the snapshot to the local cluster,
+    # and get VM's account, domain ID, zone ID at the same time.
+    # We'll need this to create the volume in the same domain, account, zone
     #
     logging.debug("Copy snapshot %s to the local cluster", snapshot_gid)
-    args = {
-        "remoteId": snapshot_gid,
-        "remoteLocation": config["SP_BACKUP_LOCATION_NAME"],
-        "template": config["SP_LOCAL_TEMPLATE"],
-    }
-    try:
-        res = sp_api.snapshotFromRemote(args)
-    except spapi.ApiError as err:
-        # A local copy of the snapshot may already be created. This is OK.
-        if err.name != "objectExists":
-            raise
+    transfer_start = time.monotonic()
 
-    snapshot_size = sp_api.snapshotDescribe(snapshot_name).size
+    async def list_server():
+        with timed("cs_list"):
+            return await cs_api.call("listVirtualMachines", id=server)
+
+    _, res = await asyncio.gather(
+        copy_from_remote(sp_api, snapshot_name),
+        list_server(),
+    )
+
+    snapshot_size = (await sp_api.snapshotDescribe(snapshot_name))["size"]
     volume_size = int(snapshot_size / 2**30)
     logging.debug("Getting the size of the snapshot for the new volume %s", volume_size)
 
-    #
-    # Get VM's account, domain ID, zone ID
-    # We'll need this to create the volume in the same domain, account, zone
-    #
-
-    res = cs_api.listVirtualMachines(id=server)
     vm = res["virtualmachine"][0]
     assert "account" in vm, "Can't get VM's account"
     assert "domainid" in vm, "Can't get VM's domainId"
@@ -271,16 +305,16 @@ def create_volume_and_attach(
     logging.info("Create a new volume")
     logging.debug("Creating the new volume in domain ID %s", vm["domainid"])
     logging.debug("Creating the new voluem with account %s", vm["account"])
-    jobid = cs_api.createVolume(
-        account = vm["account"],
-        domainid = vm["domainid"],
-        diskofferingid = config["CS_BACKUP_DISKOFFERING_ID"],
-        zoneid = vm["zoneid"],
-        size = volume_size,
-        name = f"Restore of {volume_uuid}"
-    )["jobid"]
-    res = wait_job(jobid)
-    is_error_cs_result(res)
+    with timed("cs_job"):
+        res = await (await cs_api.call_async(
+            "createVolume",
+            account = vm["account"],
+            domainid = vm["domainid"],
+            diskofferingid = config["CS_BACKUP_DISKOFFERING_ID"],
+            zoneid = vm["zoneid"],
+            size = volume_size,
+            name = f"{RESTORE_VOLUME_PREFIX}{volume_uuid}"
+        ))
     new_cs_volume = res["volume"]
     assert new_cs_volume["state"] == "Allocated"
     new_volume_uuid = new_cs_volume["id"]
@@ -290,20 +324,22 @@ def create_volume_and_attach(
     # attach and detach the volume to change the state to from Allocated to Ready
     #
     logging.debug("Attach and detach the new volume")
-    jobid = cs_api.attachVolume(id=new_volume_uuid, virtualmachineid=server)["jobid"]
-    res = wait_job(jobid)
-    is_error_cs_result(res)
+    with timed("cs_job"):
+        res = await (await cs_api.call_async(
+            "attachVolume", id=new_volume_uuid, virtualmachineid=server
+        ))
     assert res["volume"]["state"] == "Ready"
 
-    jobid = cs_api.detachVolume(id=new_volume_uuid)["jobid"]
-    res = wait_job(jobid)
-    is_error_cs_result(res)
+    with timed("cs_job"):
+        res = await (await cs_api.call_async(
+            "detachVolume", id=new_volume_uuid
+        ))
     new_cs_volume = res["volume"]
     assert new_cs_volume["state"] == "Ready"
 
     # Fix. ACS 4.16 doesn't update the path on attach/detach.
-    res = cs_api.listVolumes(id=new_volume_uuid)
-    is_error_cs_result(res)
+    with timed("cs_list"):
+        res = await cs_api.call("listVolumes", id=new_volume_uuid)
     new_cs_volume = res["volume"][0]
 
     sp_volume_gid = new_cs_volume["path"].split("/")[-1]
@@ -316,26 +352,136 @@ def create_volume_and_attach(
         "Revert the new volume %s to the snapshot %s", sp_volume_name,
         snapshot_name
     )
-    args = {
-        "toSnapshot": snapshot_name,
-    }
-    res = sp_api.volumeRevert(sp_volume_name, args)
+    await revert_volume(sp_api, sp_volume_name, snapshot_name)
 
     #
     # attach the cs volume to the VM
     #
     logging.debug("Attach volume %s to VM %s", new_volume_uuid, server)
-    jobid = cs_api.attachVolume(id=new_volume_uuid, virtualmachineid=server)["jobid"]
-    vol = wait_job(jobid)["volume"]
+    with timed("cs_job"):
+        vol = (await (await cs_api.call_async(
+            "attachVolume", id=new_volume_uuid, virtualmachineid=server
+        )))["volume"]
     assert vol["state"] == "Ready"
     assert vol["virtualmachineid"] == server
     logging.info("Volume attached")
 
+    # the volume is restored, the data is transferred in the background
+    await wait_for_transfer(sp_api, [snapshot_name], transfer_start,
+                            get_transfer_record_timeout())
+
     #
     # delete snapshots on the local cluster
     #
     logging.debug("Delete snapshot %s", snapshot_name)
-    sp_api.snapshotDelete(snapshot_name)
+    await delete_snapshot(sp_api, snapshot_name)
+
+
+async def get_remote_snapshot_sizes(sp_api: StorPoolApi) -> Dict[str, int]:
+    """
+    Returns the size of the snapshots on the backup location by global ID
+    """
+    return {
+        snap["globalId"]: snap["size"]
+        for snap in await sp_api.snapshotsRemoteList()
+        if snap["location"] == config["SP_BACKUP_LOCATION_NAME"]
+    }
+
+
+async def plan_restore(
+        cs_api: CloudStackApi,
+        sp_api: StorPoolApi,
+        backup: Dict[str, Any],
+        volume_uuid: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Builds the execution plan of revert_vm(), or of
+    create_volume_and_attach() if volume_uuid is given, without changing
+    anything, and estimates its duration using the recorded timings.
+
+    :param backup: backup item, as returned by get_backups()
+    :param volume_uuid: UUID of the volume to be restored by attach
+    :return: the plan
+    """
+    vm_uuid = backup["entity_id"]["name"].split("=", maxsplit=1)[1]
+    snapshot_map: Dict[str, str] = dict(backup["extra_info"]["sp"]["map"])
+    fix_map(snapshot_map)
+
+    plan = {
+        "vm": vm_uuid,
+        "backup_id": backup["create_ts"],
+        "backup_age_min": int((time.time() - backup["create_ts"]) / 60),
+        "transfers": [],
+        "errors": [],
+    }
+
+    if volume_uuid is None:
+        sizes, res = await asyncio.gather(
+            get_remote_snapshot_sizes(sp_api),
+            cs_api.call("listVolumes", virtualmachineid=vm_uuid, listall=True),
+        )
+        volumes = {vol["id"]: vol.get("path") for vol in res["volume"]}
+    else:
+        sizes = await get_remote_snapshot_sizes(sp_api)
+        volumes = {volume_uuid: None}
+
+    for uuid, path in volumes.items():
+        if uuid not in snapshot_map:
+            plan["errors"].append(f"Volume {uuid} not found in the backup")
+            continue
+        snapshot_name = snapshot_map[uuid]
+        plan["transfers"].append({
+            "uuid": uuid,
+            "path": path,
+            "snapshot": snapshot_name,
+            "size": sizes.get(snapshot_name.lstrip("~")),
+        })
+
+    # the snapshots of all volumes are copied and reverted in parallel.
+    # The restore doesn't wait for the data, it is transferred in the
+    # background, and the local snapshots are deleted after that.
+    size = sum(item["size"] or 0 for item in plan["transfers"])
+    duration = (
+        get_latency("vcctl_status") +
+        get_latency("snapshot_from_remote") +
+        get_latency("volume_revert")
+    )
+    if volume_uuid is None:
+        duration += (
+            get_latency("cs_list") +
+            get_latency("stop_vm") +
+            get_latency("reassign")
+        )
+    else:
+        # create, attach, detach, attach, and the listVolumes for the path.
+        # listVirtualMachines runs together with snapshotFromRemote
+        duration += get_latency("cs_list") + 4 * get_latency("cs_job")
+    plan["size"] = size
+    plan["duration"] = duration
+    plan["transfer_duration"] = size / get_transfer_rate()
+    return plan
+
+
+def print_plan(plan: Dict[str, Any]) -> None:
+    print(f"VM {plan['vm']}, backup {plan['backup_id']}, "
+          f"{plan['backup_age_min']} minutes old")
+    for error in plan["errors"]:
+        print(f"ERROR: {error}")
+    for item in plan["transfers"]:
+        size = "unknown size" if item["size"] is None \
+            else f"{item['size'] / 2**30:.1f} GiB"
+        target = item["path"] or "a new volume"
+        print(f"  volume {item['uuid']}: copy snapshot {item['snapshot']} "
+              f"({size}), revert {target}")
+    print(f"Estimated wall-clock time: {plan['duration']:.1f}s")
+    print(f"Transfer {plan['size'] / 2**30:.1f} GiB at "
+          f"{get_transfer_rate() / 2**20:.1f} MiB/s: "
+          f"{plan['transfer_duration']:.1f}s from the start of the restore, "
+          "it continues in the background")
+    missing = get_missing(list(DEFAULT_TIMINGS) + ["transfer"])
+    if missing:
+        print(f"No recorded timings for {', '.join(missing)}. "
+              "Default values used.")
 
 
 def check_backup_is_uuid_format(backup_list) -> None:
@@ -351,14 +497,344 @@ def check_backup_is_uuid_format(backup_list) -> None:
 
 
 
+async def get_cs_volumes(cs_api: CloudStackApi) -> List[Dict[str, Any]]:
+    """
+    Returns all volumes in CloudStack, including the project volumes
+    """
+    lists = await asyncio.gather(
+        cs_api.list_all("listVolumes", "volume", listall=True),
+        cs_api.list_all("listVolumes", "volume", listall=True, projectid="-1"),
+    )
+    return lists[0] + lists[1]
+
+
+def get_backup_snapshot_gids(status: List[Dict[str, Any]]) -> Set[str]:
+    """
+    Returns the global IDs of the snapshots copied to the backup cluster,
+    which are not kept by VolumeCare on any other location.
+    These are the snapshots brought back by snapshotFromRemote.
+    """
+    remote = set()
+    local = set()
+    for bck in status:
+        for entry in bck.get("history", []):
+            snapshot_map = entry.get("extra_info", {}).get("sp", {}).get("map")
+            if not snapshot_map:
+                continue
+            gids = {name.lstrip("~") for name in snapshot_map.values()}
+            if entry["id"]["location"] == config["SP_BACKUP_CLUSTER_ID"]:
+                remote |= gids
+            else:
+                local |= gids
+    return remote - local
+
+
+def get_cs_path_names(cs_volumes: List[Dict[str, Any]]) -> Set[str]:
+    """
+    Returns the StorPool global IDs and names used as paths of the
+    CloudStack volumes
+    """
+    names = set()
+    for vol in cs_volumes:
+        path = vol.get("path")
+        if not path:
+            continue
+        if not path.startswith(CS_PATH_PREFIXES):
+            # keep the volume this path may refer to
+            logging.warning("Unknown path format %s of volume %s",
+                path, vol["id"])
+        names.add(path.split("/")[-1].lstrip("~"))
+    return names
+
+
+def is_remote_copy(snap: Dict[str, Any], backup_gids: Set[str]) -> bool:
+    """
+    Checks if the snapshot is a local copy created by snapshotFromRemote:
+    a backup snapshot, created with SP_LOCAL_TEMPLATE and without the tags
+    of the snapshots managed by VolumeCare
+    """
+    tags = snap.get("tags") or {}
+    return (
+        not snap.get("deleted") and
+        not snap.get("recoveringFromRemote") and
+        snap["globalId"] in backup_gids and
+        snap.get("templateName") == config["SP_LOCAL_TEMPLATE"] and
+        not any(tag in tags for tag in VC_SNAPSHOT_TAGS)
+    )
+
+
+async def find_orphans(
+        cs_api: CloudStackApi,
+        sp_api: StorPoolApi,
+        cluster_id: Optional[str]
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Lists the CloudStack volumes, the VolumeCare backups and the StorPool
+    volumes, snapshots and attachments, and returns the orphans as
+    classify_orphans() does.
+
+    :param cluster_id: SP_CLUSTER_ID of the local StorPool cluster
+    """
+    cs_volumes, status, attachments, sp_volumes, sp_snapshots = \
+        await asyncio.gather(
+            get_cs_volumes(cs_api),
+            get_backup_list(config),
+            sp_api.attachmentsList(),
+            sp_api.volumesList(),
+            sp_api.snapshotsList(),
+        )
+    return classify_orphans(cs_volumes, status, attachments, sp_volumes,
+                            sp_snapshots, cluster_id)
+
+
+def classify_orphans(
+        cs_volumes: List[Dict[str, Any]],
+        status: List[Dict[str, Any]],
+        attachments: List[Dict[str, Any]],
+        sp_volumes: List[Dict[str, Any]],
+        sp_snapshots: List[Dict[str, Any]],
+        cluster_id: Optional[str]
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Finds the StorPool volumes and snapshots left behind by failover,
+    revert and attach operations.
+
+    A volume is orphaned if it is tagged by CloudStack or the DR tools,
+    and neither its global ID nor its name is the path of any CloudStack
+    volume.
+    A snapshot is orphaned if it is a local copy of a snapshot
+    from the backup cluster, see is_remote_copy(). Snapshots are never
+    orphaned on the backup cluster itself, where they are the backups.
+    A CloudStack volume is orphaned if it was created by the attach command
+    and is not attached to a VM anymore.
+
+    :param cluster_id: SP_CLUSTER_ID of the local StorPool cluster
+    :return: {"volumes": [...], "snapshots": [...], "attached": [...],
+        "restored": [...]}
+    """
+    if not cs_volumes:
+        raise RuntimeError("No volumes found in CloudStack. Check the CS API")
+    cs_names = get_cs_path_names(cs_volumes)
+    backup_gids = get_backup_snapshot_gids(status)
+
+    attached = {
+        att["volume"]
+        for att in attachments
+        if not att["snapshot"]
+    }
+
+    orphans = {"volumes": [], "snapshots": [], "attached": [], "restored": []}
+
+    # volumes created by the attach command and detached after use
+    for vol in cs_volumes:
+        if (
+            vol["name"].startswith(RESTORE_VOLUME_PREFIX) and
+            "virtualmachineid" not in vol
+        ):
+            orphans["restored"].append({
+                "name": vol["id"],
+                "size": vol["size"],
+                "uuid": vol["name"][len(RESTORE_VOLUME_PREFIX):],
+            })
+
+    for vol in sp_volumes:
+        tags = vol.get("tags") or {}
+        if not any(tag in tags for tag in GC_VOLUME_TAGS):
+            continue
+        if (
+            vol["globalId"] in cs_names or
+            vol["name"].lstrip("~") in cs_names
+        ):
+            continue
+        item = {
+            "name": vol["name"],
+            "globalId": vol["globalId"],
+            "size": vol["size"],
+            "uuid": tags.get("uuid"),
+            "cvm": tags.get("cvm"),
+            "vc_policy": tags.get("vc_policy", tags.get("vc-policy")),
+        }
+        if vol["name"] in attached:
+            orphans["attached"].append(item)
+        else:
+            orphans["volumes"].append(item)
+
+    if cluster_id is None or cluster_id == config["SP_BACKUP_CLUSTER_ID"]:
+        logging.warning("SP_CLUSTER_ID is %s, the backup cluster or unknown."
+            " Skipping the snapshots", cluster_id)
+        sp_snapshots = []
+
+    for snap in sp_snapshots:
+        if not is_remote_copy(snap, backup_gids):
+            continue
+        orphans["snapshots"].append({
+            "name": snap["name"],
+            "globalId": snap["globalId"],
+            "size": snap["size"],
+        })
+
+    return orphans
+
+
+def print_orphans(orphans: Dict[str, List[Dict[str, Any]]]) -> None:
+    for kind in ("volumes", "attached", "snapshots", "restored"):
+        items = orphans[kind]
+        size = sum(item["size"] for item in items)
+        print(f"{kind}: {len(items)}, {size / 2**30:.1f} GiB")
+        for item in items:
+            print(" ", item["name"], item["size"],
+                item.get("uuid") or "-", item.get("cvm") or "-")
+
+
+async def delete_orphans(
+        cs_api: CloudStackApi,
+        sp_api: StorPoolApi,
+        orphans: Dict[str, List[Dict[str, Any]]],
+        jobs: int = 8,
+        detach: bool = False,
+        restored: bool = False
+) -> int:
+    """
+    Deletes the orphaned volumes and snapshots in parallel.
+
+    :param orphans: as returned by find_orphans()
+    :param jobs: number of parallel delete requests
+    :param detach: detach and delete the attached orphaned volumes too
+    :param restored: delete the detached CloudStack volumes created by
+        attach too. These are only reported otherwise.
+    :return: number of failed deletes
+    """
+    volumes = [item["name"] for item in orphans["volumes"]]
+    if detach and orphans["attached"]:
+        attached = [item["name"] for item in orphans["attached"]]
+        logging.info("Detaching %d volumes", len(attached))
+        await sp_api.volumesReassignWait({
+            "reassign": [
+                {
+                    "volume": name,
+                    "detach": "all",
+                }
+                for name in attached
+            ],
+        })
+        volumes += attached
+    elif orphans["attached"]:
+        logging.warning("Skipping %d attached volumes",
+            len(orphans["attached"]))
+
+    snapshots = [item["name"] for item in orphans["snapshots"]]
+    cs_volumes = []
+    if restored:
+        cs_volumes = [item["name"] for item in orphans["restored"]]
+    elif orphans["restored"]:
+        logging.warning("Skipping %d detached restored volumes",
+            len(orphans["restored"]))
+
+    async def delete_cs_volume(volume_uuid):
+        await cs_api.call("deleteVolume", id=volume_uuid)
+
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def delete(func, name):
+        async with semaphore:
+            try:
+                await func(name)
+            except CloudStackError as err:
+                logging.error("Failed to delete %s: %s", name, err)
+                return False
+            except ApiError as err:
+                # already deleted by someone else. This is OK.
+                if err.name == "objectDoesNotExist":
+                    return True
+                logging.error("Failed to delete %s: %s", name, err)
+                return False
+        logging.debug("Deleted %s", name)
+        return True
+
+    work = [(sp_api.volumeDelete, name) for name in volumes]
+    work += [(sp_api.snapshotDelete, name) for name in snapshots]
+    work += [(delete_cs_volume, name) for name in cs_volumes]
+    logging.info("Deleting %d volumes, %d snapshots and %d restored volumes",
+        len(volumes), len(snapshots), len(cs_volumes))
+    results = await asyncio.gather(*(
+        delete(func, name) for func, name in work
+    ))
+
+    failed = results.count(False)
+    logging.info("Deleted %d objects, %d failed",
+        len(results) - failed, failed)
+    return failed
+
+
+async def run(args) -> int:
+    sp_config = read_storpool_config()
+    async with CloudStackApi(**read_cloudstack_config()) as cs_api, \
+            StorPoolApi.from_config(sp_config) as sp_api:
+
+        if args.command == "list":
+            backup_list = await get_backups(args.vm_uuid)
+            check_backup_is_uuid_format(backup_list)
+            list_volumes(backup_list, args.quiet)
+            return 0
+
+        if args.command == "revert":
+            backup_list = await get_backups(args.vm_uuid)
+            try:
+                backup = backup_list[args.backup_id]
+            except KeyError:
+                logging.error("Backup ID %s not found for VM %s",
+                              args.backup_id, args.vm_uuid)
+                sys.exit(1)
+            if args.plan:
+                print_plan(await plan_restore(cs_api, sp_api, backup))
+                return 0
+            await revert_vm(cs_api, sp_api, backup)
+            save_timings()
+            return 0
+
+        if args.command == "attach":
+            backup_list = await get_backups(args.vm_uuid)
+            try:
+                backup = backup_list[args.backup_id]
+            except KeyError:
+                logging.error("Backup ID %s not found for VM %s",
+                              args.backup_id, args.vm_uuid)
+                sys.exit(1)
+            if args.plan:
+                print_plan(await plan_restore(cs_api, sp_api, backup,
+                                              args.volume_uuid))
+                return 0
+            await create_volume_and_attach(cs_api, sp_api, args.volume_uuid,
+                                           backup, args.server_uuid)
+            save_timings()
+            return 0
+
+        if args.command == "gc":
+            orphans = await find_orphans(cs_api, sp_api,
+                                         sp_config.get("SP_CLUSTER_ID"))
+            print_orphans(orphans)
+            if args.dry_run:
+                return 0
+            if await delete_orphans(cs_api, sp_api, orphans, jobs=args.jobs,
+                                    detach=args.detach,
+                                    restored=args.restored):
+                sys.exit(1)
+            return 0
+
+    sys.exit("unknown command")
+
+
 def main():
 
     """
     list <vm_uuid>
-    revert <vm_uuid> <backup_id>
-    attach <vm_uuid> <backup_id> <volume_uuid> <server_uuid>
+    revert [-p] <vm_uuid> <backup_id>
+    attach [-p] <vm_uuid> <backup_id> <volume_uuid> <server_uuid>
+    gc [-n] [-j jobs] [--detach] [--restored]
     """
 
+    global config
+
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--verbose', action='count', default=0)
     subparsers = parser.add_subparsers(dest="command")
@@ -376,6 +852,8 @@ def main():
     restore_cmd.add_argument("vm_uuid", help="UUID of the VM to be reverted")
     restore_cmd.add_argument("backup_id", type=int,
         help="ID of the backup to be restored")
+    restore_cmd.add_argument("-p", "--plan", action="store_true",
+        help="Do nothing. Print the execution plan and the estimated time")
 
 
     attach_cmd = subparsers.add_parser("attach",
@@ -390,6 +868,21 @@ def main():
         "server_uuid",
         help="UUID of the backup server, where the restored volume will be attached."
     )
+    attach_cmd.add_argument("-p", "--plan", action="store_true",
+        help="Do nothing. Print the execution plan and the estimated time")
+
+    gc_cmd = subparsers.add_parser("gc",
+        help="Delete StorPool volumes and snapshots not used by CloudStack,"
+             " left after failover, revert or attach"
+    )
+    gc_cmd.add_argument("-n", "--dry-run", action="store_true",
+        help="Do nothing. Print the orphaned volumes and snapshots only")
+    gc_cmd.add_argument("-j", "--jobs", type=int, default=8,
+        help="Number of parallel delete requests")
+    gc_cmd.add_argument("--detach", action="store_true",
+        help="Detach and delete orphaned volumes that are still attached")
+    gc_cmd.add_argument("--restored", action="store_true",
+        help="Delete the detached CloudStack volumes created by attach")
 
     args = parser.parse_args()
     if args.command is None:
@@ -398,42 +891,17 @@ def main():
 
     if args.verbose > 1:
         logging.basicConfig(level=logging.DEBUG)
-        logging.getLogger("urllib3.connectionpool").setLevel(logging.INFO)
     elif args.verbose > 0:
         logging.basicConfig(level=logging.INFO)
 
-    read_config()
-    get_apis()
-
-    if args.command == "list":
-        backup_list = get_backup_list(args.vm_uuid)
-        check_backup_is_uuid_format(backup_list)
-        list_volumes(backup_list, args.quiet)
-        return 0
-
-    if args.command == "revert":
-        backup_list = get_backup_list(args.vm_uuid)
-        try:
-            backup = backup_list[args.backup_id]
-        except KeyError:
-            logging.error("Backup ID %s not found for VM %s",
-                          args.backup_id, args.vm_uuid)
-            sys.exit(1)
-        revert_vm(backup)
-        return 0
-
-    if args.command == "attach":
-        backup_list = get_backup_list(args.vm_uuid)
-        try:
-            backup = backup_list[args.backup_id]
-        except KeyError:
-            logging.error("Backup ID %s not found for VM %s",
-                          args.backup_id, args.vm_uuid)
-            sys.exit(1)
-        create_volume_and_attach(args.volume_uuid, backup, args.server_uuid)
-        return 0
+    config = read_config("/etc/storpool/backup-tool.conf")
+    load_timings(config.get("TIMINGS_FILE", TIMINGS_FILE))
 
-    sys.exit("unknown command")
+    try:
+        return asyncio.run(run(args))
+    except CloudStackError as err:
+        logging.error("Error executing CS command: %s", err)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,26 @@
+"""
+Shared asyncio core of the backup-tool and DR scripts.
+
+Non-blocking clients for the CloudStack and StorPool HTTP APIs, a runner for
+`storpool_vcctl`, the timings used for planning, and the helpers used by both
+scripts.
+"""
+
+from .cloudstack import AsyncJob, CloudStackApi, CloudStackError
+from .config import read_cloudstack_config, read_config, read_storpool_config
+from .storpool import ApiError, StorPoolApi
+from .volumecare import fix_map, get_backup_list, get_vm_backups
+
+__all__ = [
+    "ApiError",
+    "AsyncJob",
+    "CloudStackApi",
+    "CloudStackError",
+    "StorPoolApi",
+    "fix_map",
+    "get_backup_list",
+    "get_vm_backups",
+    "read_cloudstack_config",
+    "read_config",
+    "read_storpool_config",
+]
@@ -0,0 +1,169 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import ssl
+import urllib.parse
+
+from typing import Any, Dict, List, Optional, Union
+
+import aiohttp
+
+
+class CloudStackError(Exception):
+    """
+    Error returned by the CloudStack API or by an async job
+    """
+
+
+class AsyncJob:
+    """
+    Handle of a CloudStack async job. Await it to get the job result.
+    """
+
+    def __init__(self, api: "CloudStackApi", jobid: str, timeout: int = 10,
+                 interval: float = 1):
+        self.api = api
+        self.jobid = jobid
+        self.timeout = timeout
+        self.interval = interval
+
+    async def wait(self) -> Dict[str, Any]:
+        for _ in range(self.timeout):
+            await asyncio.sleep(self.interval)
+            job = await self.api.call("queryAsyncJobResult", jobid=self.jobid)
+            if job["jobstatus"] == 0:  # 0 = running
+                continue
+            result = job["jobresult"]
+            if job["jobstatus"] == 2:  # 2 = failed
+                raise CloudStackError(result.get("errortext", result))
+            return result
+        raise RuntimeError("Timeout")
+
+    def __await__(self):
+        return self.wait().__await__()
+
+
+class CloudStackApi:
+    """
+    Non-blocking CloudStack API client. All requests share one connection
+    pool.
+
+    Use as an async context manager:
+
+        async with CloudStackApi(**read_cloudstack_config()) as cs_api:
+            res = await cs_api.call("listVolumes", virtualmachineid=vm_uuid)
+
+    `verify` and `cert` have the same meaning as in `cloudstack.ini` of the
+    cs client: `verify` is true, false, or the CA bundle of the endpoint,
+    `cert` is the client certificate, with its key in `cert_key` if it is
+    not in the same file.
+    """
+
+    def __init__(self, endpoint: str, key: str, secret: str,
+                 connections: int = 100, timeout: float = 60,
+                 verify: Union[bool, str] = True, cert: Optional[str] = None,
+                 cert_key: Optional[str] = None, **kwargs):
+        if kwargs:
+            raise RuntimeError(
+                "Unsupported settings in the CloudStack configuration: "
+                + ", ".join(sorted(kwargs))
+            )
+        self.endpoint = endpoint
+        self.key = key
+        self.secret = secret
+        self.connections = int(connections)
+        self.timeout = float(timeout)
+        if isinstance(verify, str) and verify.lower() in (
+                "true", "yes", "on", "1", "false", "no", "off", "0"):
+            verify = verify.lower() in ("true", "yes", "on", "1")
+        self.verify = verify
+        self.cert = cert
+        self.cert_key = cert_key
+        self.session = None
+
+    def _ssl(self) -> Union[bool, ssl.SSLContext]:
+        """
+        Returns the `ssl` argument of the connector
+        """
+        if self.verify is True and self.cert is None:
+            return True
+        if self.verify is False and self.cert is None:
+            return False
+        cafile = self.verify if isinstance(self.verify, str) else None
+        context = ssl.create_default_context(cafile=cafile)
+        if self.verify is False:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        if self.cert is not None:
+            context.load_cert_chain(self.cert, self.cert_key)
+        return context
+
+    async def __aenter__(self) -> "CloudStackApi":
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.connections,
+                                           ssl=self._ssl()),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.session.close()
+
+    def _sign(self, params: Dict[str, str]) -> str:
+        query = "&".join(
+            f"{key}={urllib.parse.quote(value, safe='*')}"
+            for key, value in sorted(
+                params.items(), key=lambda item: item[0].lower()
+            )
+        )
+        digest = hmac.new(
+            self.secret.encode(), query.lower().encode(), hashlib.sha1
+        ).digest()
+        return base64.b64encode(digest).decode()
+
+    async def call(self, command: str, **kwargs) -> Dict[str, Any]:
+        """
+        Executes an API command and returns its response
+        """
+        params = {"command": command, "apikey": self.key, "response": "json"}
+        for key, value in kwargs.items():
+            if isinstance(value, bool):
+                value = "true" if value else "false"
+            params[key] = str(value)
+        params["signature"] = self._sign(params)
+
+        async with self.session.get(self.endpoint, params=params) as resp:
+            data = await resp.json(content_type=None)
+        res = next(iter(data.values()))
+        if "errorcode" in res:
+            raise CloudStackError(
+                f"{command}: {res.get('errortext', res['errorcode'])}"
+            )
+        return res
+
+    async def call_async(self, command: str, timeout: int = 10,
+                         **kwargs) -> AsyncJob:
+        """
+        Starts an async API command and returns the handle of the job
+        """
+        res = await self.call(command, **kwargs)
+        return AsyncJob(self, res["jobid"], timeout=timeout)
+
+    async def list_all(self, command: str, list_key: str,
+                       pagesize: int = 500, **kwargs) -> List[Dict[str, Any]]:
+        """
+        Executes a list command and returns all pages of the result
+
+        :param command: e.g. listVolumes
+        :param list_key: the list in the response, e.g. volume
+        """
+        items = []
+        page = 1
+        while True:
+            res = await self.call(command, page=page, pagesize=pagesize,
+                                  **kwargs)
+            items += res.get(list_key, [])
+            if len(items) >= res.get("count", 0) or list_key not in res:
+                return items
+            page += 1
@@ -0,0 +1,66 @@
+import configparser
+import glob
+import os
+import socket
+
+from typing import Dict
+
+import confget
+
+
+def read_config(filename: str) -> Dict[str, str]:
+    """
+    Reads the settings of the tool, e.g. /etc/storpool/dr.conf
+    """
+    return confget.read_ini_file(confget.Config(
+        [], filename=filename
+    ))[""]
+
+
+def read_storpool_config(
+        filename: str = "/etc/storpool.conf",
+        confdir: str = "/etc/storpool.conf.d"
+) -> Dict[str, str]:
+    """
+    Reads the StorPool configuration the way the StorPool tools do:
+    /etc/storpool.conf, then /etc/storpool.conf.d/*.conf in order. In every
+    file the settings in the section of this host override the global ones.
+    """
+    hostname = socket.gethostname()
+    res: Dict[str, str] = {}
+    for path in [filename] + sorted(glob.glob(os.path.join(confdir, "*.conf"))):
+        if not os.path.exists(path):
+            continue
+        sections = confget.read_ini_file(confget.Config([], filename=path))
+        res.update(sections.get("", {}))
+        for section in (hostname, hostname.split(".")[0]):
+            if section in sections:
+                res.update(sections[section])
+                break
+    return res
+
+
+def read_cloudstack_config() -> Dict[str, str]:
+    """
+    Reads the CloudStack API endpoint and credentials from the environment,
+    or from the [cloudstack] section of `cloudstack.ini` in the current
+    directory or `~/.cloudstack.ini`
+    """
+    env = {
+        key: os.environ[f"CLOUDSTACK_{key.upper()}"]
+        for key in ("endpoint", "key", "secret", "verify", "cert", "cert_key")
+        if f"CLOUDSTACK_{key.upper()}" in os.environ
+    }
+    if all(key in env for key in ("endpoint", "key", "secret")):
+        return env
+
+    parser = configparser.ConfigParser()
+    found = parser.read([
+        os.path.expanduser("~/.cloudstack.ini"),
+        "cloudstack.ini",
+    ])
+    if not found or not parser.has_section("cloudstack"):
+        raise RuntimeError("CloudStack configuration cloudstack.ini not found")
+    res = dict(parser["cloudstack"])
+    res.update(env)
+    return res
@@ -0,0 +1,110 @@
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+
+class ApiError(Exception):
+    """
+    Error returned by the StorPool API. `name` is the StorPool error name,
+    e.g. objectExists
+    """
+
+    def __init__(self, name: str, descr: str):
+        super().__init__(f"{name}: {descr}")
+        self.name = name
+        self.descr = descr
+
+
+class StorPoolApi:
+    """
+    Non-blocking StorPool API client. All requests share one connection
+    pool. The objects are returned as the JSON dicts of the API.
+
+    Use as an async context manager:
+
+        async with StorPoolApi.from_config(config) as sp_api:
+            volumes = await sp_api.volumesList()
+    """
+
+    def __init__(self, host: str, port: int, auth: str,
+                 connections: int = 100, timeout: float = 300):
+        self.url = f"http://{host}:{port}/ctrl/1.0/"
+        self.auth = auth
+        self.connections = connections
+        self.timeout = timeout
+        self.session = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, str], **kwargs) -> "StorPoolApi":
+        """
+        Creates a client from the SP_API_HTTP_HOST, SP_API_HTTP_PORT and
+        SP_AUTH_TOKEN settings
+        """
+        return cls(
+            host=config["SP_API_HTTP_HOST"],
+            port=int(config.get("SP_API_HTTP_PORT", 81)),
+            auth=config["SP_AUTH_TOKEN"],
+            **kwargs
+        )
+
+    async def __aenter__(self) -> "StorPoolApi":
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"Authorization": f"Storpool v1:{self.auth}"},
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.session.close()
+
+    async def call(self, method: str, path: str,
+                   body: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Executes an API call and returns its data
+        """
+        async with self.session.request(
+            method, self.url + path, json=body
+        ) as resp:
+            res = await resp.json(content_type=None)
+        if "error" in res:
+            error = res["error"]
+            raise ApiError(error.get("name", "unknown"),
+                           error.get("descr", ""))
+        return res["data"]
+
+    async def volumesList(self) -> List[Dict[str, Any]]:
+        return await self.call("GET", "VolumesList")
+
+    async def snapshotsList(self) -> List[Dict[str, Any]]:
+        return await self.call("GET", "SnapshotsList")
+
+    async def snapshotsRemoteList(self) -> List[Dict[str, Any]]:
+        return await self.call("GET", "SnapshotsRemoteList")
+
+    async def attachmentsList(self) -> List[Dict[str, Any]]:
+        return await self.call("GET", "AttachmentsList")
+
+    async def snapshotDescribe(self, name: str) -> Dict[str, Any]:
+        return await self.call("GET", f"SnapshotDescribe/{name}")
+
+    async def volumeCreate(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call("POST", "VolumeCreate", args)
+
+    async def volumeDelete(self, name: str) -> Dict[str, Any]:
+        return await self.call("POST", f"VolumeDelete/{name}", {})
+
+    async def volumeRevert(self, name: str,
+                           args: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call("POST", f"VolumeRevert/{name}", args)
+
+    async def volumesReassignWait(
+            self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call("POST", "VolumesReassignWait", args)
+
+    async def snapshotDelete(self, name: str) -> Dict[str, Any]:
+        return await self.call("POST", f"SnapshotDelete/{name}", {})
+
+    async def snapshotFromRemote(
+            self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call("POST", "SnapshotFromRemote", args)
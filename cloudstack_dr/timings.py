@@ -0,0 +1,145 @@
+"""
+Duration of the operations and the transfer rate, recorded from earlier
+runs and used to estimate the duration of a plan
+"""
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+
+from typing import Dict, List, Optional
+
+# Used for the estimation when there are no recorded timings, in seconds
+DEFAULT_TIMINGS = {
+    "vcctl_status": 5.0,
+    "cs_list": 0.5,
+    "cs_job": 2.0,
+    "stop_vm": 10.0,
+    "start_vm": 30.0,
+    "start_vm_async": 0.5,
+    "update_path": 2.0,
+    "reassign": 1.0,
+    "volume_create": 0.5,
+    "volume_revert": 1.0,
+    "snapshot_from_remote": 0.5,
+    "snapshot_delete": 0.5,
+}
+# Used when there are no recorded transfers, in bytes per second
+DEFAULT_TRANSFER_RATE = 100 * 2**20
+
+# the timings of the earlier runs and of this run
+timings: Dict[str, Dict[str, float]] = {}
+# the timings recorded by this run, not saved yet
+recorded: Dict[str, Dict[str, float]] = {}
+timings_file: Optional[str] = None
+
+
+def load_timings(filename: str) -> None:
+    """
+    Loads the timings of the earlier runs. Each tool has its own file, the
+    timings of the primary and of the backup cluster are not mixed.
+    """
+    global timings, timings_file
+    timings_file = os.path.expanduser(filename)
+    timings = read_timings(timings_file)
+
+
+def read_timings(filename: str) -> Dict[str, Dict[str, float]]:
+    try:
+        with open(filename, encoding="utf_8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_timings() -> None:
+    """
+    Adds the timings recorded by this run to the file. The file is locked
+    and replaced atomically, the samples of concurrent runs are not lost.
+    """
+    if timings_file is None or not recorded:
+        return
+    try:
+        with open(f"{timings_file}.lock", "w", encoding="utf_8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            saved = read_timings(timings_file)
+            for op, entry in recorded.items():
+                add_timing(saved, op, entry)
+            fd, tmp_file = tempfile.mkstemp(
+                dir=os.path.dirname(timings_file), suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "w", encoding="utf_8") as file:
+                    json.dump(saved, file, indent=2)
+                os.replace(tmp_file, timings_file)
+            except BaseException:
+                os.unlink(tmp_file)
+                raise
+        recorded.clear()
+    except (OSError, ValueError) as err:
+        logging.warning("Can't save timings: %s", err)
+
+
+def add_timing(target: Dict[str, Dict[str, float]], op: str,
+               entry: Dict[str, float]) -> None:
+    total = target.setdefault(op, {"count": 0, "seconds": 0.0, "bytes": 0})
+    for key in ("count", "seconds", "bytes"):
+        total[key] += entry[key]
+
+
+def record_timing(op: str, seconds: float, size: int = 0) -> None:
+    entry = {"count": 1, "seconds": seconds, "bytes": size}
+    add_timing(timings, op, entry)
+    add_timing(recorded, op, entry)
+
+
+@contextlib.contextmanager
+def timed(op: str, size: int = 0):
+    """
+    Records the duration of the operation, if it completes without error
+    """
+    start = time.monotonic()
+    yield
+    record_timing(op, time.monotonic() - start, size)
+
+
+def get_latency(op: str) -> float:
+    """
+    Returns the average duration of the operation in seconds
+    """
+    entry = timings.get(op)
+    if entry and entry["count"]:
+        return entry["seconds"] / entry["count"]
+    return DEFAULT_TIMINGS[op]
+
+
+def get_transfer_rate() -> float:
+    """
+    Returns the average transfer rate from the backup cluster in bytes/s
+    """
+    entry = timings.get("transfer")
+    if entry and entry["seconds"] and entry["bytes"]:
+        return entry["bytes"] / entry["seconds"]
+    return DEFAULT_TRANSFER_RATE
+
+
+def get_missing(ops: List[str]) -> List[str]:
+    """
+    Returns the operations without recorded timings
+    """
+    return sorted(op for op in ops if op not in timings)
+
+
+def estimate_wall_time(durations: List[float], jobs: int) -> float:
+    """
+    Estimates the time to run the tasks in order on a pool of `jobs` workers
+    """
+    workers = [0.0] * max(1, min(jobs, len(durations)))
+    for duration in durations:
+        idx = workers.index(min(workers))
+        workers[idx] += duration
+    return max(workers)
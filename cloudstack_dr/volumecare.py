@@ -0,0 +1,68 @@
+import asyncio
+import json
+import logging
+import subprocess
+
+from typing import Any, Dict, List
+
+
+async def get_backup_list(config: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Returns the output of `storpool_vcctl status --json`. The command is
+    executed over ssh on VC_SSH_HOST, if it is set.
+    """
+    cmd = [
+        'storpool_vcctl',
+        'status',
+        '--json',
+    ]
+
+    if "VC_SSH_HOST" in config:
+        cmd = [
+            "ssh",
+            "-l", config.get("VC_SSH_USER", "root"),
+            config["VC_SSH_HOST"],
+        ] + cmd
+
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE
+    )
+    stdout, _ = await process.communicate()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return json.loads(stdout.decode("utf_8"))
+
+
+def get_vm_backups(
+        backup_list: List[Dict[str, Any]],
+        vm_uuid: str,
+        location: str
+) -> List[Dict[str, Any]]:
+    """
+    Returns the backups of the VM transferred to the location, the latest
+    first
+    """
+    backup_name = f"cvm={vm_uuid}"
+    for bck in backup_list:
+        if (
+            bck["type"] == "vm" and
+            bck["id"]["name"] == backup_name
+        ):
+            logging.debug("backups found for VM %s", vm_uuid)
+            return [
+                entry
+                for entry in bck["history"]
+                if entry["id"]["location"] == location
+            ]
+    # no backups found
+    return []
+
+
+def fix_map(map:Dict[str, Any]) -> None:
+    """
+    Removes leading ~ in the key names
+    """
+    for key in list(map.keys()):
+        if key[0] == "~":
+            trimmed_k = key[1:]
+            map[trimmed_k] = map.pop(key)
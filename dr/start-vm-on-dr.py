@@ -1,65 +1,73 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
+import asyncio
 import logging
-import subprocess
+import os
 import sys
-import time
 
-from typing import Dict, Any, List
-
-# pip install storpool
-from storpool import spapi
-import confget
-
-# pip install cs
-import cs
-
-
-config: confget.Config = None  # Config is in /etc/storpool/dr.conf
-cs_api: cs.CloudStack = None
-sp_api: spapi.Api = None
-
-
-def read_config():
-    global config
-    config = confget.read_ini_file(confget.Config(
-        [], filename="/etc/storpool/dr.conf"
-    ))[""]
-
-
-def get_apis():
-    global cs_api, sp_api
-    if cs_api is None:
-        cs_api = cs.CloudStack(**cs.read_config())
-    if sp_api is None:
-        sp_api = spapi.Api(
-            host=config["SP_API_HTTP_HOST"],
-            port=config["SP_API_HTTP_PORT"],
-            auth=config["SP_AUTH_TOKEN"]
-        )
-
-
-def get_volumes(vm_uuid: str) -> List[str]:
-    global cs_api
-
-    res = cs_api.listVolumes(virtualmachineid=vm_uuid)
-    volume_list = res["volume"]
+from typing import Dict, Any, List, Optional
+
+# the shared core package is in the parent directory of this script
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+)
+
+from cloudstack_dr import (
+    CloudStackApi,
+    CloudStackError,
+    StorPoolApi,
+    fix_map,
+    get_backup_list,
+    get_vm_backups,
+    read_cloudstack_config,
+    read_config,
+)
+from cloudstack_dr.timings import (
+    estimate_wall_time,
+    get_latency,
+    get_missing,
+    load_timings,
+    save_timings,
+    timed,
+)
+
+
+config: Dict[str, str] = None  # Config is in /etc/storpool/dr.conf
+
+# timings of earlier runs, used by --plan for the estimation
+TIMINGS_FILE = "~/.start-vm-on-dr-timings.json"
+
+# Operations of a VM failover, used for the estimation
+DR_OPERATIONS = [
+    "vcctl_status",
+    "cs_list",
+    "volume_create",
+    "update_path",
+    "start_vm",
+    "start_vm_async",
+]
+
+
+async def get_volumes(cs_api: CloudStackApi, vm_uuid: str) -> List[str]:
+    with timed("cs_list"):
+        res = await cs_api.call("listVolumes", virtualmachineid=vm_uuid)
+    volume_list = res.get("volume", [])
     return [
         vol["id"]
         for vol in volume_list
     ]
 
 
-def get_vc_policy(vm_uuid: str) -> str:
-    global cs_api
-    res = cs_api.listTags(
-        resoucetype="UserVM",
-        resourceid=vm_uuid,
-        key="vc-policy"
-    )
-    tag_list = res["tag"]
+async def get_vc_policy(cs_api: CloudStackApi, vm_uuid: str) -> str:
+    with timed("cs_list"):
+        res = await cs_api.call(
+            "listTags",
+            resourcetype="UserVm",
+            resourceid=vm_uuid,
+            key="vc-policy"
+        )
+    tag_list = res.get("tag", [])
     if tag_list:
         value = tag_list[0]["value"]
         logging.debug("vc-policy tag found for VM %s: %s", vm_uuid, value)
@@ -67,65 +75,34 @@ def get_vc_policy(vm_uuid: str) -> str:
     return None
 
 
-def get_backup_list() -> Dict[int, Any]:
-    cmd = [
-        'storpool_vcctl',
-        'status',
-        '--json',
-    ]
-
-    if "VC_SSH_HOST" in config:
-        cmd = [
-            "ssh",
-            "-l", config.get("VC_SSH_USER", "root"),
-            config["VC_SSH_HOST"],
-        ] + cmd
-
-    process = subprocess.run(
-        cmd, stdout=subprocess.PIPE, check=True, encoding="utf_8"
+def get_latest_backup(
+        backup_list: List[Dict[str, Any]],
+        vm_uuid: str
+) -> Optional[Dict[str, Any]]:
+    """
+    Get the latest backup of this VM, transferred to the backup cluster
+    """
+    transferred_backups = get_vm_backups(
+        backup_list, vm_uuid, config["SP_BACKUP_CLUSTER_ID"]
     )
-    backup_list = json.loads(process.stdout)
-    return backup_list
+    if not transferred_backups:
+        return None
+    return transferred_backups[0]
 
 
-def get_snapshot_map(backup_list: Dict[str, Any], vm_uuid:str) -> Dict[str, str]:
+def get_snapshot_map(backup_list: List[Dict[str, Any]], vm_uuid:str) -> Dict[str, str]:
     """
     Get the latest backup of this VM and return the snapshot map
     """
 
-    backup_name = f"cvm={vm_uuid}"
-    for bck in backup_list:
-        if (
-            bck["type"] == "vm" and
-            bck["id"]["name"] == backup_name
-        ):
-            logging.debug("backups found for VM %s", vm_uuid)
-            history = bck["history"]
-            transferred_backups = [
-                entry
-                for entry in history
-                if entry["id"]["location"] == config["SP_BACKUP_CLUSTER_ID"]
-            ]
-            if not transferred_backups:
-                return None
-            latest = transferred_backups[0]
-            logging.debug("The latest backup of VM %s is %d minutes old.",
-                vm_uuid,
-                latest["age_in_h"] * 60
-            )
-            return latest["extra_info"]["sp"]["map"]
-    # no backups found
-    return None
-
-
-def fix_map(map:Dict[str, Any]) -> None:
-    """
-    Removes leading ~ in the key names
-    """
-    for key in list(map.keys()):
-        if key[0] == "~":
-            trimmed_k = key[1:]
-            map[trimmed_k] = map.pop(key)
+    latest = get_latest_backup(backup_list, vm_uuid)
+    if latest is None:
+        return None
+    logging.debug("The latest backup of VM %s is %d minutes old.",
+        vm_uuid,
+        latest["age_in_h"] * 60
+    )
+    return latest["extra_info"]["sp"]["map"]
 
 
 def check_all_volumes(
@@ -139,8 +116,8 @@ def check_all_volumes(
     return True
 
 
-def create_volume(snapshot: str, vm_uuid: str, vol_uuid: str, vc_policy: str,
-                  noop=False) -> str:
+async def create_volume(sp_api: StorPoolApi, snapshot: str, vm_uuid: str,
+                        vol_uuid: str, vc_policy: str, noop=False) -> str:
     logging.debug("Create a new volume from snapshot %s", snapshot)
     if noop:
         return "NNN.N.NNN"
@@ -151,112 +128,303 @@ def create_volume(snapshot: str, vm_uuid: str, vol_uuid: str, vc_policy: str,
             "uuid": vol_uuid,
             "vc_policy": vc_policy,
         }
-        res = sp_api.volumeCreate({
-            "parent": snapshot,
-            "tags": tags,
-        })
-        name = res.to_json()["name"]
+        with timed("volume_create"):
+            res = await sp_api.volumeCreate({
+                "parent": snapshot,
+                "tags": tags,
+            })
+        name = res["name"]
         return name.lstrip("~")
 
 
-def wait_job(jobid, timeout=10):
-    for _ in range(timeout):
-        time.sleep(1)
-        job = cs_api.queryAsyncJobResult(jobid=jobid)
-        if job["jobstatus"] != 0:  # 0 = running
-            return job["jobresult"]
-    raise RuntimeError("Timeout")
-
-
-def update_path(volume:str, vol_gid:str, noop=False) -> None:
+async def update_path(cs_api: CloudStackApi, volume:str, vol_gid:str,
+                      noop=False) -> None:
     logging.debug("Update path, volume %s, vol_gid=%s", volume, vol_gid)
     if noop:
         return
-    jobid = cs_api.updateVolume(id=volume, path=f"/dev/storpool-byid/{vol_gid}")["jobid"]
-    wait_job(jobid)
+    with timed("update_path"):
+        job = await cs_api.call_async(
+            "updateVolume", id=volume, path=f"/dev/storpool-byid/{vol_gid}"
+        )
+        await job
+
+
+async def restore_volume(cs_api: CloudStackApi, sp_api: StorPoolApi,
+                         volume: str, snapshot: str, vm_uuid: str,
+                         vc_policy: str, noop=False) -> None:
+    vol_gid = await create_volume(
+        sp_api,
+        snapshot,
+        vm_uuid=vm_uuid,
+        vol_uuid=volume,
+        vc_policy=vc_policy,
+        noop=noop
+    )
+    await update_path(cs_api, volume, vol_gid, noop=noop)
 
 
-def start_vm(vm_uuid: str, noop=False, async_=False) -> None:
+async def start_vm(cs_api: CloudStackApi, vm_uuid: str, noop=False,
+                   async_=False) -> Optional[str]:
     logging.debug("Starting VM %s", vm_uuid)
     if noop:
-        return
-    jobid = cs_api.startVirtualMachine(
-        id=vm_uuid,
-        clusterid=config["CS_CLUSTER_ID"]
-    )["jobid"]
+        return None
     if async_:
+        with timed("start_vm_async"):
+            job = await cs_api.call_async(
+                "startVirtualMachine",
+                id=vm_uuid,
+                clusterid=config["CS_CLUSTER_ID"]
+            )
         logging.info("Async job started - Start VM %s", vm_uuid)
-        return jobid
-    res = wait_job(jobid, timeout=30)["virtualmachine"]
+        return job.jobid
+    with timed("start_vm"):
+        job = await cs_api.call_async(
+            "startVirtualMachine",
+            id=vm_uuid,
+            clusterid=config["CS_CLUSTER_ID"],
+            timeout=30
+        )
+        res = (await job)["virtualmachine"]
     logging.info("VM %s, state %s, on host %s", vm_uuid,
                  res.get("state"), res.get("hostname"))
+    return None
 
 
-def activate_vm(vm_uuid:str, backup_list, noop=False, async_=False) -> None:
-    # get the list of all volumes attached to the VM
-    volumes = get_volumes(vm_uuid)
+async def activate_vm(cs_api: CloudStackApi, sp_api: StorPoolApi,
+                      vm_uuid:str, backup_list, noop=False,
+                      async_=False) -> Optional[str]:
+    # get the list of all volumes attached to the VM and the vc-policy tag
+    volumes, vc_policy = await asyncio.gather(
+        get_volumes(cs_api, vm_uuid),
+        get_vc_policy(cs_api, vm_uuid),
+    )
 
-    # get vc-policy tag
-    vc_policy = get_vc_policy(vm_uuid)
     if vc_policy is None:
         logging.error("vc-policy tag not found for VM %s", vm_uuid)
-        return
+        return None
 
     # get the list of all snapshots from the latest backup of the VM
     snapshot_map = get_snapshot_map(backup_list, vm_uuid)
     if not snapshot_map:
         logging.error("No backups found for VM %s", vm_uuid)
-        return
+        return None
     fix_map(snapshot_map)
 
     # Make sure there is a snapshot for each volume
     if not check_all_volumes(volumes, snapshot_map):
-        logging.error("Missing snapshots for VM %s. Skipping this VM")
-        return
+        logging.error("Missing snapshots for VM %s. Skipping this VM", vm_uuid)
+        return None
+
+    # let all volumes complete before reporting an error
+    results = await asyncio.gather(*(
+        restore_volume(cs_api, sp_api, volume, snapshot, vm_uuid=vm_uuid,
+                       vc_policy=vc_policy, noop=noop)
+        for volume, snapshot in snapshot_map.items()
+    ), return_exceptions=True)
+    for res in results:
+        if isinstance(res, Exception):
+            raise res
+
+    # start the VM
+    return await start_vm(cs_api, vm_uuid, noop=noop, async_=async_)
+
+
+async def get_cs_list(cs_api: CloudStackApi, command: str, list_key: str,
+                      **kwargs) -> List[Dict[str, Any]]:
+    """
+    Calls a CS list command for all accounts and projects
+    """
+    lists = await asyncio.gather(
+        cs_api.list_all(command, list_key, listall=True, **kwargs),
+        cs_api.list_all(command, list_key, listall=True, projectid="-1",
+                        **kwargs),
+    )
+    return lists[0] + lists[1]
+
+
+async def build_plan(cs_api: CloudStackApi, sp_api: StorPoolApi,
+                     vm_list: List[str], backup_list) -> List[Dict[str, Any]]:
+    """
+    Builds the execution plan for the VMs, without changing anything.
+    Uses one bulk call for the volumes, tags and snapshots of all VMs.
+
+    :return: a list of plan entries, one per VM, in the start order
+    """
+    cs_volumes, tags, snapshots = await asyncio.gather(
+        get_cs_list(cs_api, "listVolumes", "volume"),
+        get_cs_list(cs_api, "listTags", "tag", resourcetype="UserVm",
+                    key="vc-policy"),
+        sp_api.snapshotsList(),
+    )
+
+    vm_volumes: Dict[str, List[Dict[str, Any]]] = {}
+    for vol in cs_volumes:
+        if vol.get("virtualmachineid"):
+            vm_volumes.setdefault(vol["virtualmachineid"], []).append(vol)
+
+    vc_policies = {
+        tag["resourceid"]: tag["value"]
+        for tag in tags
+    }
+
+    snapshot_sizes = {
+        snap["globalId"]: snap["size"]
+        for snap in snapshots
+    }
+
+    plan = []
+    for vm_uuid in vm_list:
+        entry = {
+            "vm": vm_uuid,
+            "vc_policy": vc_policies.get(vm_uuid),
+            "backup_age_min": None,
+            "volumes": [],
+            "errors": [],
+        }
+        plan.append(entry)
+
+        if entry["vc_policy"] is None:
+            entry["errors"].append("vc-policy tag not found")
+        latest = get_latest_backup(backup_list, vm_uuid)
+        if latest is None:
+            entry["errors"].append("No backups found")
+            continue
+        entry["backup_age_min"] = int(latest["age_in_h"] * 60)
+
+        snapshot_map = dict(latest["extra_info"]["sp"]["map"])
+        fix_map(snapshot_map)
+        paths = {
+            vol["id"]: vol.get("path")
+            for vol in vm_volumes.get(vm_uuid, [])
+        }
+        for volume in paths:
+            if volume not in snapshot_map:
+                entry["errors"].append(f"Snapshot missing for volume {volume}")
+
+        for volume, snapshot in snapshot_map.items():
+            entry["volumes"].append({
+                "uuid": volume,
+                "snapshot": snapshot,
+                "size": snapshot_sizes.get(snapshot.lstrip("~")),
+                "path": paths.get(volume),
+            })
+
+    return plan
+
 
-    for volume, snapshot in snapshot_map.items():
-        vol_gid = create_volume(
-            snapshot,
-            vm_uuid=vm_uuid,
-            vol_uuid=volume,
-            vc_policy=vc_policy,
-            noop=noop
+def estimate_plan(plan: List[Dict[str, Any]], jobs=1, async_=False) -> float:
+    """
+    Estimates the duration of each VM in the plan and the total wall-clock
+    time, using the recorded timings.
+    The volumes of a VM are created and updated in parallel.
+    """
+    start_op = "start_vm_async" if async_ else "start_vm"
+    for entry in plan:
+        if entry["errors"]:
+            entry["duration"] = get_latency("cs_list")
+            continue
+        entry["duration"] = (
+            get_latency("cs_list") +
+            get_latency("volume_create") +
+            get_latency("update_path") +
+            get_latency(start_op)
         )
-        update_path(volume, vol_gid, noop=noop)
+    return get_latency("vcctl_status") + estimate_wall_time(
+        [entry["duration"] for entry in plan], jobs
+    )
 
-    # start the VM
-    start_vm(vm_uuid, noop=noop, async_=async_)
+
+def print_plan(plan: List[Dict[str, Any]], total: float, jobs: int) -> None:
+    for order, entry in enumerate(plan, start=1):
+        print(f"{order}. VM {entry['vm']}, vc-policy {entry['vc_policy']}, "
+              f"backup age {entry['backup_age_min']} min, "
+              f"estimated {entry['duration']:.1f}s")
+        for error in entry["errors"]:
+            print(f"   ERROR: {error}, the VM will be skipped")
+        for vol in entry["volumes"]:
+            size = "unknown size" if vol["size"] is None \
+                else f"{vol['size'] / 2**30:.1f} GiB"
+            print(f"   volume {vol['uuid']}: create from snapshot "
+                  f"{vol['snapshot']} ({size}), replace path {vol['path']}")
+    print(f"Estimated wall-clock time: {total:.1f}s with {jobs} jobs")
+    missing = get_missing(DR_OPERATIONS)
+    if missing:
+        print(f"No recorded timings for {', '.join(missing)}. "
+              "Default values used.")
+
+
+async def run(args) -> None:
+    async with CloudStackApi(**read_cloudstack_config()) as cs_api, \
+            StorPoolApi.from_config(config) as sp_api:
+
+        with timed("vcctl_status"):
+            backup_list = await get_backup_list(config)
+
+        if args.plan:
+            plan = await build_plan(cs_api, sp_api, args.vm, backup_list)
+            total = estimate_plan(plan, jobs=args.jobs, async_=args.async_)
+            print_plan(plan, total, args.jobs)
+            return
+
+        semaphore = asyncio.Semaphore(args.jobs)
+        failed = []
+
+        async def activate(vm_uuid):
+            # a failed VM must not stop the failover of the other VMs
+            async with semaphore:
+                try:
+                    return await activate_vm(cs_api, sp_api, vm_uuid,
+                        backup_list, noop=args.noop, async_=args.async_)
+                except Exception as err:
+                    logging.error("Failed to start VM %s: %s", vm_uuid, err)
+                    failed.append(vm_uuid)
+                    return None
+
+        results = await asyncio.gather(*(
+            activate(vm_uuid) for vm_uuid in args.vm
+        ))
+        job_list = [jobid for jobid in results if jobid is not None]
+        logging.info("%d async jobs started.", len(job_list))
+
+        if not args.noop:
+            save_timings()
+
+        if failed:
+            logging.error("Failed VMs: %s", " ".join(failed))
+            sys.exit(1)
+
+        # ToDo: Wait for async jobs to complete and report the status
 
 
 def main():
+    global config
+
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--verbose', action='count', default=0)
     parser.add_argument("-n", "--noop", action="store_true",
         help="Do nothing. Print the commands only")
     parser.add_argument("-a", "--async", dest="async_", action="store_true",
         help="Don't wait for async jobs when possible")
+    parser.add_argument("-p", "--plan", action="store_true",
+        help="Do nothing. Print the execution plan and the estimated time")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="Number of VMs to be started in parallel")
     parser.add_argument("vm", nargs="+", help="List of UUID of VMs to be started")
 
     args = parser.parse_args()
     if args.verbose > 1:
         logging.basicConfig(level=logging.DEBUG)
-        logging.getLogger("urllib3.connectionpool").setLevel(logging.INFO)
     elif args.verbose > 0:
         logging.basicConfig(level=logging.INFO)
 
-    read_config()
-    get_apis()
-
-    backup_list = get_backup_list()
-    job_list = []
-    for vm_uuid in args.vm:
-        jobid = activate_vm(vm_uuid, backup_list, noop=args.noop,
-            async_=args.async_)
-        if args.async_:
-            job_list.append(jobid)
-    logging.info("%d async jobs started.", len(job_list))
+    config = read_config("/etc/storpool/dr.conf")
+    load_timings(config.get("TIMINGS_FILE", TIMINGS_FILE))
 
-    # ToDo: Wait for async jobs to complete and report the status
+    try:
+        asyncio.run(run(args))
+    except CloudStackError as err:
+        logging.error("Error executing CS command: %s", err)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
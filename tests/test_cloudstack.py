@@ -0,0 +1,152 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cloudstack_dr import AsyncJob, CloudStackApi, CloudStackError  # noqa: E402
+
+# computed with the signing method of the cs client
+SIGNATURE = "YUQMwBCrfi0IwxyXGfnYTlMfmZs="
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def json(self, content_type=None):
+        return self.data
+
+
+class FakeSession:
+    """
+    Returns the given responses in order and records the request params
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, endpoint, params):
+        self.requests.append(params)
+        return FakeResponse(self.responses.pop(0))
+
+
+def api(*responses):
+    cs_api = CloudStackApi("http://cs-mgmt:8080/client/api", "KEY", "SECRET")
+    cs_api.session = FakeSession(*responses)
+    return cs_api
+
+
+def test_sign():
+    params = {
+        "command": "listVirtualMachines",
+        "response": "json",
+        "apikey": "KEY",
+        "name": "web server*",
+        "listall": "true",
+        "projectid": "-1",
+        "page": "1",
+        "pagesize": "500",
+    }
+    assert api()._sign(params) == SIGNATURE
+
+
+def test_call_signs_request():
+    cs_api = api({"listvirtualmachinesresponse": {"count": 0}})
+    asyncio.run(cs_api.call("listVirtualMachines", name="web server*",
+                            listall=True, projectid=-1, page=1, pagesize=500))
+    params = cs_api.session.requests[0]
+    assert params["listall"] == "true"
+    assert params["signature"] == SIGNATURE
+
+
+def test_call_error():
+    cs_api = api({"listvolumesresponse": {
+        "errorcode": 431, "errortext": "Unable to find volume",
+    }})
+    with pytest.raises(CloudStackError, match="Unable to find volume"):
+        asyncio.run(cs_api.call("listVolumes", id="vol1"))
+
+
+def test_list_all_pages():
+    cs_api = api(
+        {"listvolumesresponse": {"count": 5, "volume": [{"id": 1}, {"id": 2}]}},
+        {"listvolumesresponse": {"count": 5, "volume": [{"id": 3}, {"id": 4}]}},
+        {"listvolumesresponse": {"count": 5, "volume": [{"id": 5}]}},
+    )
+    res = asyncio.run(cs_api.list_all("listVolumes", "volume", pagesize=2))
+    assert [vol["id"] for vol in res] == [1, 2, 3, 4, 5]
+    assert [req["page"] for req in cs_api.session.requests] == ["1", "2", "3"]
+
+
+def test_list_all_empty():
+    cs_api = api({"listvolumesresponse": {}})
+    assert asyncio.run(cs_api.list_all("listVolumes", "volume")) == []
+    assert len(cs_api.session.requests) == 1
+
+
+def test_list_all_stops_without_count():
+    cs_api = api(
+        {"listvolumesresponse": {"volume": [{"id": 1}, {"id": 2}]}},
+        {"listvolumesresponse": {"volume": [{"id": 3}]}},
+    )
+    res = asyncio.run(cs_api.list_all("listVolumes", "volume", pagesize=2))
+    assert [vol["id"] for vol in res] == [1, 2]
+    assert len(cs_api.session.requests) == 1
+
+
+def test_list_all_stops_without_key():
+    cs_api = api(
+        {"listvolumesresponse": {"count": 3, "volume": [{"id": 1}, {"id": 2}]}},
+        {"listvolumesresponse": {"count": 3}},
+        {"listvolumesresponse": {"count": 3, "volume": [{"id": 3}]}},
+    )
+    res = asyncio.run(cs_api.list_all("listVolumes", "volume", pagesize=2))
+    assert [vol["id"] for vol in res] == [1, 2]
+    assert len(cs_api.session.requests) == 2
+
+
+def job(status, result=None):
+    return {"queryasyncjobresultresponse": {
+        "jobstatus": status, "jobresult": result or {},
+    }}
+
+
+def test_async_job():
+    cs_api = api(job(0), job(1, {"virtualmachine": {"state": "Running"}}))
+    res = asyncio.run(AsyncJob(cs_api, "job1", interval=0).wait())
+    assert res == {"virtualmachine": {"state": "Running"}}
+    assert [req["jobid"] for req in cs_api.session.requests] == ["job1"] * 2
+
+
+def test_async_job_failed():
+    cs_api = api(job(2, {"errorcode": 530, "errortext": "VM not found"}))
+    with pytest.raises(CloudStackError, match="VM not found"):
+        asyncio.run(AsyncJob(cs_api, "job1", interval=0).wait())
+
+
+def test_async_job_timeout():
+    cs_api = api(job(0), job(0))
+    with pytest.raises(RuntimeError, match="Timeout"):
+        asyncio.run(AsyncJob(cs_api, "job1", timeout=2, interval=0).wait())
+
+
+def test_ssl():
+    cs_api = CloudStackApi("https://cs-mgmt/client/api", "KEY", "SECRET",
+                           verify="false")
+    assert cs_api._ssl() is False
+
+
+def test_unknown_setting():
+    with pytest.raises(RuntimeError, match="method"):
+        CloudStackApi("https://cs-mgmt/client/api", "KEY", "SECRET",
+                      method="post")
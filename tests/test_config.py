@@ -0,0 +1,71 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cloudstack_dr import config, read_storpool_config  # noqa: E402
+
+
+@pytest.fixture
+def storpool_conf(tmp_path, monkeypatch):
+    monkeypatch.setattr(config.socket, "gethostname",
+                        lambda: "kvm1.example.net")
+    confdir = tmp_path / "storpool.conf.d"
+    confdir.mkdir()
+    (tmp_path / "storpool.conf").write_text(
+        "SP_CLUSTER_ID=bgu4.b\n"
+        "SP_API_HTTP_HOST=10.1.2.3\n"
+        "SP_AUTH_TOKEN=1234\n"
+        "\n"
+        "[kvm2]\n"
+        "SP_API_HTTP_HOST=10.1.2.5\n"
+    )
+    return tmp_path / "storpool.conf", confdir
+
+
+def read(files):
+    filename, confdir = files
+    return read_storpool_config(str(filename), str(confdir))
+
+
+def test_global(storpool_conf):
+    assert read(storpool_conf) == {
+        "SP_CLUSTER_ID": "bgu4.b",
+        "SP_API_HTTP_HOST": "10.1.2.3",
+        "SP_AUTH_TOKEN": "1234",
+    }
+
+
+def test_host_section_in_confdir(storpool_conf):
+    _, confdir = storpool_conf
+    (confdir / "api.conf").write_text(
+        "SP_API_HTTP_PORT=81\n"
+        "\n"
+        "[kvm1]\n"
+        "SP_API_HTTP_HOST=10.1.2.4\n"
+    )
+    res = read(storpool_conf)
+    assert res["SP_API_HTTP_HOST"] == "10.1.2.4"
+    assert res["SP_API_HTTP_PORT"] == "81"
+
+
+def test_full_hostname_section(storpool_conf):
+    _, confdir = storpool_conf
+    (confdir / "api.conf").write_text(
+        "[kvm1.example.net]\n"
+        "SP_API_HTTP_HOST=10.1.2.6\n"
+        "\n"
+        "[kvm1]\n"
+        "SP_API_HTTP_HOST=10.1.2.4\n"
+    )
+    assert read(storpool_conf)["SP_API_HTTP_HOST"] == "10.1.2.6"
+
+
+def test_confdir_order(storpool_conf):
+    _, confdir = storpool_conf
+    (confdir / "b.conf").write_text("SP_AUTH_TOKEN=b\n")
+    (confdir / "a.conf").write_text("SP_AUTH_TOKEN=a\n")
+    (confdir / "a.conf.bak").write_text("SP_AUTH_TOKEN=bak\n")
+    assert read(storpool_conf)["SP_AUTH_TOKEN"] == "b"
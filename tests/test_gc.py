@@ -0,0 +1,184 @@
+import asyncio
+import importlib.util
+import os
+
+import pytest
+
+SCRIPT = os.path.join(
+    os.path.dirname(__file__), "..", "backup-tool", "backup-tool.py"
+)
+spec = importlib.util.spec_from_file_location("backup_tool", SCRIPT)
+backup_tool = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(backup_tool)
+
+BACKUP_CLUSTER = "bgu4.n"
+LOCAL_CLUSTER = "bgu4.b"
+
+
+@pytest.fixture(autouse=True)
+def config():
+    backup_tool.config = {
+        "SP_BACKUP_CLUSTER_ID": BACKUP_CLUSTER,
+        "SP_LOCAL_TEMPLATE": "nvme",
+    }
+
+
+def cs_volume(uuid, path, vm=None, name="ROOT"):
+    vol = {"id": uuid, "name": name, "path": path, "size": 2**30}
+    if vm is not None:
+        vol["virtualmachineid"] = vm
+    return vol
+
+
+def sp_volume(name, gid, **tags):
+    return {"name": name, "globalId": gid, "size": 2**30, "tags": tags}
+
+
+def sp_snapshot(gid, template="nvme", **tags):
+    return {
+        "name": f"~{gid}",
+        "globalId": gid,
+        "size": 2**30,
+        "templateName": template,
+        "tags": tags,
+    }
+
+
+def vc_status(remote=(), local=()):
+    history = [
+        {"id": {"location": BACKUP_CLUSTER},
+         "extra_info": {"sp": {"map": {"vol1": f"~{gid}"}}}}
+        for gid in remote
+    ] + [
+        {"id": {"location": LOCAL_CLUSTER},
+         "extra_info": {"sp": {"map": {"vol1": f"~{gid}"}}}}
+        for gid in local
+    ]
+    return [{"type": "vm", "id": {"name": "cvm=vm1"}, "history": history}]
+
+
+def classify(cs_volumes=None, status=(), attachments=(), sp_volumes=(),
+             sp_snapshots=(), cluster_id=LOCAL_CLUSTER):
+    if cs_volumes is None:
+        cs_volumes = [cs_volume("vol0", "/dev/storpool-byid/bgu4.b.live")]
+    return backup_tool.classify_orphans(
+        cs_volumes, list(status), list(attachments), list(sp_volumes),
+        list(sp_snapshots), cluster_id
+    )
+
+
+def test_no_cs_volumes():
+    with pytest.raises(RuntimeError):
+        classify(cs_volumes=[])
+
+
+def test_volume_by_global_id():
+    orphans = classify(sp_volumes=[
+        sp_volume("~bgu4.b.live", "bgu4.b.live", cs="volume"),
+        sp_volume("~bgu4.b.old", "bgu4.b.old", cs="volume", uuid="vol0"),
+    ])
+    assert [v["name"] for v in orphans["volumes"]] == ["~bgu4.b.old"]
+
+
+def test_volume_by_name_path():
+    orphans = classify(
+        cs_volumes=[cs_volume("vol1", "/dev/storpool/vm-root-1", vm="vm1")],
+        sp_volumes=[sp_volume("vm-root-1", "bgu4.b.abc", cs="volume",
+                              uuid="vol1")],
+    )
+    assert orphans["volumes"] == []
+
+
+def test_volume_unknown_path_format_is_kept():
+    orphans = classify(
+        cs_volumes=[cs_volume("vol1", "bgu4.b.abc", vm="vm1")],
+        sp_volumes=[sp_volume("~bgu4.b.abc", "bgu4.b.abc", cs="volume")],
+    )
+    assert orphans["volumes"] == []
+
+
+def test_untagged_volume_is_kept():
+    orphans = classify(sp_volumes=[sp_volume("other", "bgu4.b.x")])
+    assert orphans["volumes"] == []
+
+
+def test_attached_volume():
+    orphans = classify(
+        sp_volumes=[sp_volume("~bgu4.b.old", "bgu4.b.old", cs="volume")],
+        attachments=[{"volume": "~bgu4.b.old", "snapshot": False}],
+    )
+    assert orphans["volumes"] == []
+    assert [v["name"] for v in orphans["attached"]] == ["~bgu4.b.old"]
+
+
+def test_remote_copy_snapshot():
+    orphans = classify(
+        status=vc_status(remote=["bgu4.b.copy", "bgu4.b.vc", "bgu4.b.tpl"]),
+        sp_snapshots=[
+            sp_snapshot("bgu4.b.copy"),
+            sp_snapshot("bgu4.b.vc", **{"vc-policy": "daily"}),
+            sp_snapshot("bgu4.b.tpl", template="hdd"),
+            sp_snapshot("bgu4.b.unrelated"),
+        ],
+    )
+    assert [s["name"] for s in orphans["snapshots"]] == ["~bgu4.b.copy"]
+
+
+def test_snapshot_in_local_history_is_kept():
+    orphans = classify(
+        status=vc_status(remote=["bgu4.b.base"], local=["bgu4.b.base"]),
+        sp_snapshots=[sp_snapshot("bgu4.b.base")],
+    )
+    assert orphans["snapshots"] == []
+
+
+@pytest.mark.parametrize("cluster_id", [BACKUP_CLUSTER, None])
+def test_no_snapshots_on_backup_cluster(cluster_id):
+    orphans = classify(
+        status=vc_status(remote=["bgu4.b.old1"]),
+        sp_snapshots=[sp_snapshot("bgu4.b.old1")],
+        cluster_id=cluster_id,
+    )
+    assert orphans["snapshots"] == []
+
+
+def test_restored_volumes():
+    orphans = classify(cs_volumes=[
+        cs_volume("vol0", "/dev/storpool-byid/bgu4.b.live"),
+        cs_volume("r1", "/dev/storpool-byid/bgu4.b.r1", name="Restore of vol0"),
+        cs_volume("r2", "/dev/storpool-byid/bgu4.b.r2", vm="backup-server",
+                  name="Restore of vol0"),
+    ])
+    assert [v["name"] for v in orphans["restored"]] == ["r1"]
+
+
+class FakeApi:
+    def __init__(self):
+        self.deleted = []
+
+    async def call(self, command, **kwargs):
+        self.deleted.append((command, kwargs["id"]))
+        return {}
+
+    async def volumeDelete(self, name):
+        self.deleted.append(("volumeDelete", name))
+
+    async def snapshotDelete(self, name):
+        self.deleted.append(("snapshotDelete", name))
+
+
+@pytest.mark.parametrize("restored", [False, True])
+def test_delete_restored_only_on_request(restored):
+    api = FakeApi()
+    orphans = {
+        "volumes": [{"name": "~bgu4.b.old"}],
+        "attached": [],
+        "snapshots": [],
+        "restored": [{"name": "r1"}],
+    }
+    failed = asyncio.run(backup_tool.delete_orphans(
+        api, api, orphans, restored=restored
+    ))
+    assert failed == 0
+    assert (("deleteVolume", "r1") in api.deleted) == restored
+    assert ("volumeDelete", "~bgu4.b.old") in api.deleted
@@ -0,0 +1,279 @@
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cloudstack_dr import timings  # noqa: E402
+from cloudstack_dr.timings import (  # noqa: E402
+    DEFAULT_TIMINGS,
+    DEFAULT_TRANSFER_RATE,
+    estimate_wall_time,
+)
+
+
+def load_script(name, path):
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(os.path.dirname(__file__), "..", *path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+backup_tool = load_script("backup_tool", ("backup-tool", "backup-tool.py"))
+start_vm_on_dr = load_script("start_vm_on_dr", ("dr", "start-vm-on-dr.py"))
+
+BACKUP_CLUSTER = "bgu4.n"
+GIB = 2**30
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    monkeypatch.setattr(timings, "timings", {})
+    config = {
+        "SP_BACKUP_CLUSTER_ID": BACKUP_CLUSTER,
+        "SP_BACKUP_LOCATION_NAME": "backup",
+    }
+    backup_tool.config = config
+    start_vm_on_dr.config = config
+
+
+class FakeCloudStack:
+    def __init__(self, volumes=(), tags=()):
+        self.volumes = list(volumes)
+        self.tags = list(tags)
+
+    async def call(self, command, **kwargs):
+        assert command == "listVolumes"
+        return {"volume": [
+            vol
+            for vol in self.volumes
+            if vol["virtualmachineid"] == kwargs["virtualmachineid"]
+        ]}
+
+    async def list_all(self, command, list_key, **kwargs):
+        # the same items are returned for the projects
+        if kwargs.get("projectid") == "-1":
+            return []
+        return {"volume": self.volumes, "tag": self.tags}[list_key]
+
+
+class FakeStorPool:
+    def __init__(self, snapshots=()):
+        self.snapshots = list(snapshots)
+
+    async def snapshotsList(self):
+        return self.snapshots
+
+    async def snapshotsRemoteList(self):
+        return [
+            dict(snap, location="backup")
+            for snap in self.snapshots
+        ]
+
+
+def cs_volume(uuid, vm, gid):
+    return {"id": uuid, "virtualmachineid": vm,
+            "path": f"/dev/storpool-byid/{gid}"}
+
+
+def snapshot(gid, size):
+    return {"name": f"~{gid}", "globalId": gid, "size": size}
+
+
+def backup_list(*vms):
+    """
+    VolumeCare status with one backup on the backup cluster per VM, given
+    as (vm_uuid, {volume_uuid: snapshot_gid})
+    """
+    return [
+        {
+            "type": "vm",
+            "id": {"name": f"cvm={vm}"},
+            "history": [{
+                "id": {"location": BACKUP_CLUSTER},
+                "create_ts": int(time.time()) - 600,
+                "age_in_h": 0.5,
+                "entity_id": {"name": f"cvm={vm}"},
+                "extra_info": {"sp": {"map": {
+                    volume: f"~{gid}" for volume, gid in volumes.items()
+                }}},
+            }],
+        }
+        for vm, volumes in vms
+    ]
+
+
+def test_wall_time_one_job():
+    assert estimate_wall_time([3, 3, 3, 3], jobs=1) == 12
+
+
+def test_wall_time_packing():
+    assert estimate_wall_time([3, 3, 3, 3], jobs=2) == 6
+    # the tasks are given to the first free worker in order
+    assert estimate_wall_time([5, 1, 1, 1], jobs=2) == 5
+    assert estimate_wall_time([1, 1, 1, 5], jobs=2) == 6
+
+
+def test_wall_time_more_jobs_than_tasks():
+    assert estimate_wall_time([2, 4], jobs=8) == 4
+    assert estimate_wall_time([], jobs=4) == 0
+
+
+def dr_plan(vm_list, backups, volumes=(), tags=(), snapshots=()):
+    return asyncio.run(start_vm_on_dr.build_plan(
+        FakeCloudStack(volumes, tags), FakeStorPool(snapshots),
+        vm_list, backups
+    ))
+
+
+def test_dr_plan():
+    plan = dr_plan(
+        ["vm1"],
+        backup_list(("vm1", {"vol1": "bgu4.n.1"})),
+        volumes=[cs_volume("vol1", "vm1", "bgu4.b.1")],
+        tags=[{"resourceid": "vm1", "value": "daily"}],
+        snapshots=[snapshot("bgu4.n.1", 20 * GIB)],
+    )
+    assert plan == [{
+        "vm": "vm1",
+        "vc_policy": "daily",
+        "backup_age_min": 30,
+        "volumes": [{
+            "uuid": "vol1",
+            "snapshot": "~bgu4.n.1",
+            "size": 20 * GIB,
+            "path": "/dev/storpool-byid/bgu4.b.1",
+        }],
+        "errors": [],
+    }]
+
+
+def test_dr_plan_errors():
+    plan = dr_plan(
+        ["vm1", "vm2"],
+        backup_list(("vm1", {"vol1": "bgu4.n.1"})),
+        volumes=[
+            cs_volume("vol1", "vm1", "bgu4.b.1"),
+            cs_volume("vol2", "vm1", "bgu4.b.2"),
+        ],
+        tags=[{"resourceid": "vm1", "value": "daily"}],
+    )
+    assert plan[0]["errors"] == ["Snapshot missing for volume vol2"]
+    assert plan[0]["volumes"][0]["size"] is None
+    assert plan[1]["errors"] == ["vc-policy tag not found", "No backups found"]
+
+
+def test_dr_estimate():
+    plan = [
+        {"vm": "vm1", "errors": []},
+        {"vm": "vm2", "errors": []},
+        {"vm": "vm3", "errors": ["No backups found"]},
+    ]
+    vm_time = (
+        DEFAULT_TIMINGS["cs_list"] +
+        DEFAULT_TIMINGS["volume_create"] +
+        DEFAULT_TIMINGS["update_path"] +
+        DEFAULT_TIMINGS["start_vm"]
+    )
+    total = start_vm_on_dr.estimate_plan(plan, jobs=2)
+    # the VMs with errors are skipped after the lookup
+    assert [entry["duration"] for entry in plan] == [
+        vm_time, vm_time, DEFAULT_TIMINGS["cs_list"]
+    ]
+    assert total == pytest.approx(
+        DEFAULT_TIMINGS["vcctl_status"] + vm_time + DEFAULT_TIMINGS["cs_list"]
+    )
+
+
+def test_dr_estimate_async():
+    plan = [{"vm": "vm1", "errors": []}]
+    start_vm_on_dr.estimate_plan(plan, async_=True)
+    assert plan[0]["duration"] == pytest.approx(
+        DEFAULT_TIMINGS["cs_list"] +
+        DEFAULT_TIMINGS["volume_create"] +
+        DEFAULT_TIMINGS["update_path"] +
+        DEFAULT_TIMINGS["start_vm_async"]
+    )
+
+
+def test_dr_estimate_recorded_timings():
+    timings.record_timing("start_vm", 10)
+    timings.record_timing("start_vm", 20)
+    plan = [{"vm": "vm1", "errors": []}]
+    start_vm_on_dr.estimate_plan(plan)
+    assert plan[0]["duration"] == pytest.approx(
+        DEFAULT_TIMINGS["cs_list"] +
+        DEFAULT_TIMINGS["volume_create"] +
+        DEFAULT_TIMINGS["update_path"] +
+        15
+    )
+
+
+def restore_plan(volume_uuid=None):
+    backup = backup_list(
+        ("vm1", {"vol1": "bgu4.n.1", "vol2": "bgu4.n.2"})
+    )[0]["history"][0]
+    cs_api = FakeCloudStack([
+        cs_volume("vol1", "vm1", "bgu4.b.1"),
+        cs_volume("vol3", "vm1", "bgu4.b.3"),
+    ])
+    sp_api = FakeStorPool([
+        snapshot("bgu4.n.1", 10 * GIB),
+        snapshot("bgu4.n.2", 20 * GIB),
+    ])
+    return asyncio.run(backup_tool.plan_restore(cs_api, sp_api, backup,
+                                                volume_uuid))
+
+
+def test_revert_plan():
+    plan = restore_plan()
+    assert plan["errors"] == ["Volume vol3 not found in the backup"]
+    assert [item["uuid"] for item in plan["transfers"]] == ["vol1"]
+    assert plan["size"] == 10 * GIB
+    assert plan["duration"] == pytest.approx(
+        DEFAULT_TIMINGS["vcctl_status"] +
+        DEFAULT_TIMINGS["snapshot_from_remote"] +
+        DEFAULT_TIMINGS["volume_revert"] +
+        DEFAULT_TIMINGS["cs_list"] +
+        DEFAULT_TIMINGS["stop_vm"] +
+        DEFAULT_TIMINGS["reassign"]
+    )
+    assert plan["transfer_duration"] == pytest.approx(
+        10 * GIB / DEFAULT_TRANSFER_RATE
+    )
+
+
+def test_attach_plan():
+    plan = restore_plan("vol2")
+    assert plan["errors"] == []
+    assert plan["transfers"] == [{
+        "uuid": "vol2",
+        "path": None,
+        "snapshot": "~bgu4.n.2",
+        "size": 20 * GIB,
+    }]
+    assert plan["duration"] == pytest.approx(
+        DEFAULT_TIMINGS["vcctl_status"] +
+        DEFAULT_TIMINGS["snapshot_from_remote"] +
+        DEFAULT_TIMINGS["volume_revert"] +
+        DEFAULT_TIMINGS["cs_list"] +
+        4 * DEFAULT_TIMINGS["cs_job"]
+    )
+
+
+def test_attach_plan_missing_volume():
+    plan = restore_plan("vol3")
+    assert plan["errors"] == ["Volume vol3 not found in the backup"]
+    assert plan["size"] == 0
+
+
+def test_recorded_transfer_rate():
+    timings.record_timing("transfer", 10, 100 * GIB)
+    plan = restore_plan()
+    assert plan["transfer_duration"] == pytest.approx(1)
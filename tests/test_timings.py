@@ -0,0 +1,66 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cloudstack_dr import timings  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def state(monkeypatch):
+    monkeypatch.setattr(timings, "timings", {})
+    monkeypatch.setattr(timings, "recorded", {})
+    monkeypatch.setattr(timings, "timings_file", None)
+
+
+def start_run(filename):
+    timings.load_timings(str(filename))
+    timings.recorded.clear()
+
+
+def test_save(tmp_path):
+    filename = tmp_path / "timings.json"
+    start_run(filename)
+    timings.record_timing("transfer", 10, 2**30)
+    timings.save_timings()
+    assert json.loads(filename.read_text()) == {
+        "transfer": {"count": 1, "seconds": 10, "bytes": 2**30},
+    }
+    assert sorted(os.listdir(tmp_path)) == ["timings.json", "timings.json.lock"]
+
+
+def test_save_adds_to_earlier_runs(tmp_path):
+    filename = tmp_path / "timings.json"
+    start_run(filename)
+    timings.record_timing("start_vm", 10)
+    timings.save_timings()
+
+    start_run(filename)
+    assert timings.get_latency("start_vm") == 10
+    timings.record_timing("start_vm", 20)
+    timings.save_timings()
+    assert json.loads(filename.read_text())["start_vm"]["count"] == 2
+    assert timings.get_latency("start_vm") == 15
+
+
+def test_concurrent_runs(tmp_path):
+    filename = tmp_path / "timings.json"
+    # both runs start before any of them saves
+    start_run(filename)
+    timings.record_timing("start_vm", 10)
+    timings.save_timings()
+    timings.timings = {}
+    timings.record_timing("start_vm", 20)
+    timings.save_timings()
+    assert json.loads(filename.read_text())["start_vm"] == {
+        "count": 2, "seconds": 30, "bytes": 0,
+    }
+
+
+def test_nothing_recorded(tmp_path):
+    start_run(tmp_path / "timings.json")
+    timings.save_timings()
+    assert os.listdir(tmp_path) == []